@@ -3,280 +3,444 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import os
 import threading
+import queue
 import subprocess
-import sys
 import tempfile
 import shutil
-import math
 from datetime import datetime
-import json
-from PIL import Image, ImageTk, ImageOps  # 用于图像预览
+import functools
+import collections
+import logging
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageTk, ImageOps, ImageFilter, ImageDraw, ImageFont, ExifTags  # 用于图像预览和EXIF读取
+
+log = logging.getLogger(__name__)
 
 # 第三方工具路径配置
 base_path = os.path.abspath(".")
 thirdparty_dir = os.path.join(base_path, 'thirdparty')
 
+# thirdparty中FFmpeg的最低版本：concat列表中的file_packet_meta指令从FFmpeg 5.0开始支持
+MIN_FFMPEG_VERSION = "5.0"
+
+def format_shutter(exposure_time):
+    """将曝光时间格式化为快门速度文本（如 1/250、2）"""
+    exposure_time = float(exposure_time)
+    if 0 < exposure_time < 1:
+        return f"1/{round(1 / exposure_time)}"
+    return f"{exposure_time:g}"
+
+def read_exif_data(img):
+    """从已打开的图片中读取EXIF信息"""
+    exif_data = {'make': 'N/A', 'iso': 'N/A', 'shutter': 'N/A', 'fnumber': 'N/A'}
+    try:
+        exif = img.getexif()
+        exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+        make = exif.get(ExifTags.Base.Make)
+        iso = exif_ifd.get(ExifTags.Base.ISOSpeedRatings)
+        exposure_time = exif_ifd.get(ExifTags.Base.ExposureTime)
+        fnumber = exif_ifd.get(ExifTags.Base.FNumber)
+        if make:
+            exif_data['make'] = str(make).strip('\x00 ').replace(' ', '')
+        if isinstance(iso, tuple):
+            iso = iso[0] if iso else None
+        if iso:
+            exif_data['iso'] = str(iso)
+        if exposure_time:
+            exif_data['shutter'] = format_shutter(exposure_time)
+        if fnumber:
+            exif_data['fnumber'] = f"{float(fnumber):.1f}"
+    except (OSError, ValueError, ZeroDivisionError):
+        pass
+    return exif_data
+
 def get_exif_data(image_path):
     """获取EXIF信息"""
+    try:
+        with Image.open(image_path) as img:
+            return read_exif_data(img)
+    except OSError:
+        return {'make': 'N/A', 'iso': 'N/A', 'shutter': 'N/A', 'fnumber': 'N/A'}
+
+def format_info_text(exif_data):
+    """根据EXIF信息生成信息文本"""
+    if exif_data['iso'] != 'N/A' and exif_data['shutter'] != 'N/A' and exif_data['fnumber'] != 'N/A':
+        return f"{exif_data['make']} f/{exif_data['fnumber']} {exif_data['shutter']}s ISO{exif_data['iso']}"
+    return f"Processed {datetime.now().strftime('%Y-%m-%d')}"
+
+# 支持的图片扩展名（小写，不含点）
+IMAGE_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'jpe'})
+
+def iter_image_files(directory):
+    """递归遍历目录，按os.walk的顺序（先当前目录的文件，再子目录）返回图片路径"""
+    subdirs = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    _, dot, ext = entry.name.rpartition('.')
+                    if dot and ext.lower() in IMAGE_EXTENSIONS:
+                        yield entry.path
+    except OSError:
+        return  # 与os.walk一致，忽略无法访问的目录
+    for subdir in subdirs:
+        yield from iter_image_files(subdir)
+
+def get_info_text(image_path):
+    """根据图片的EXIF信息生成信息文本"""
+    return format_info_text(get_exif_data(image_path))
+
+def build_image_filter(input_label, output_label, text, prefix=""):
+    """构建单张图片的滤镜链：16:9模糊背景、带阴影的前景和底部信息栏
+
+    prefix用于在同一个滤镜图中处理多张图片时区分中间标签
+    """
+    # 尺寸全部由FFmpeg表达式根据输入宽度(iw)计算，无需先调用ffprobe:
+    #   16:9背景高度 = iw*9/16，信息区域高度 = 背景高度的20%，总高度 = 背景高度*1.2
+    #   drawtext中的h即总高度，文字大小为总高度的2.5%（最小40）
+    font_size = "max(40,h*0.025)"
+
+    # 阴影参数
+    shadow_size = 10
+    shadow_opacity = 0.05
+
+    return (
+        f"[{input_label}]split[{prefix}fg_src][{prefix}bg_src];"
+        f"[{prefix}fg_src]scale=w=iw:h=iw*9/16:force_original_aspect_ratio=decrease[{prefix}fg];"
+        f"[{prefix}bg_src]scale=w=iw:h=iw*9/16*1.2:force_original_aspect_ratio=increase,"
+        f"crop=w='min(iw,ih*16/9/1.2)':h='min(ih,iw*9/16*1.2)',boxblur=30:10[{prefix}bg];"
+        f"[{prefix}fg]pad=w=iw+{shadow_size}*2:h=ih+{shadow_size}*2:x={shadow_size}:y={shadow_size}:"
+        f"color=black@{shadow_opacity},split[{prefix}fg_padded][{prefix}fg_shadow];"
+        f"[{prefix}fg_shadow]boxblur=10:10[{prefix}shadow];"
+        f"[{prefix}bg][{prefix}shadow]overlay=x=(W-w)/2:y=(H-h)/2-30[{prefix}combined];"
+        f"[{prefix}combined][{prefix}fg_padded]overlay=x=(W-w)/2:y=(H-h)/2-30[{prefix}base];"
+        f"[{prefix}base]drawtext=text='{text}':fontcolor=white:fontsize='{font_size}':"
+        f"x=(w-tw)/2:y='h/1.2+h/12-{font_size}/2+50'[{output_label}]"
+    )
+
+@functools.lru_cache(maxsize=None)
+def is_encoder_available(encoder_name):
+    """检查编码器是否可用（结果会被缓存）"""
     try:
         result = subprocess.run(
-            [os.path.join(thirdparty_dir, 'exiftool'), '-make', '-ISO', '-ShutterSpeed', "-Fnumber", "-fast", image_path],
+            [os.path.join(thirdparty_dir, 'ffmpeg'), "-hide_banner", "-h", f"encoder={encoder_name}"],
             capture_output=True,
-            text=True
+            text=True,
+            timeout=10
         )
-        lines = result.stdout.strip().split('\n')
-        return {
-            'make': lines[0].replace(' ', '').split(':')[1] if len(lines) > 0 else 'N/A',
-            'iso': lines[1].replace(' ', '').split(':')[1] if len(lines) > 1 else 'N/A',
-            'shutter': lines[2].replace(' ', '').split(':')[1] if len(lines) > 2 else 'N/A',
-            'fnumber': lines[3].replace(' ', '').split(':')[1] if len(lines) > 3 else 'N/A'
-        }
+        # 未知编码器会输出 "Codec '...' is not recognized"，已知编码器以 "Encoder <name>" 开头
+        return result.stdout.startswith(f"Encoder {encoder_name} ")
     except (subprocess.CalledProcessError, FileNotFoundError):
-        return {'iso': 'N/A', 'shutter': 'N/A'}
+        return False
+    except subprocess.TimeoutExpired:
+        log.warning("Timed out checking codecs")
+        return False
+
+@functools.lru_cache(maxsize=None)
+def is_hardware_encoder_usable(encoder_name, width=320, height=240):
+    """用一帧测试画面试编码，确认硬件编码器有可用的设备和驱动（结果会被缓存）
 
-def process_image(input_path, output_path, text=""):
-    """处理单张图片，添加16:9背景和信息栏"""
-    # 获取图片尺寸
+    测试画面使用实际输出尺寸，硬件编码器通常有最大分辨率限制（如4096像素）
+    """
+    if not is_encoder_available(encoder_name):
+        return False
     try:
         result = subprocess.run(
-            [os.path.join(thirdparty_dir, 'ffprobe'), "-v", "error", "-select_streams", "v:0",
-             "-show_entries", "stream=width,height", "-of", "csv=p=0", input_path],
-            capture_output=True, text=True, timeout=10
+            [os.path.join(thirdparty_dir, 'ffmpeg'), "-hide_banner", "-v", "error",
+             "-f", "lavfi", "-i", f"color=black:s={width}x{height}:d=0.1",
+             "-frames:v", "1", "-c:v", encoder_name, "-f", "null", "-"],
+            capture_output=True,
+            timeout=10
         )
-        if result.returncode != 0:
-            print(f"Error getting image dimensions for {input_path}")
-            print(result.stderr)
-            return False
+        return result.returncode == 0
+    except FileNotFoundError:
+        return False
     except subprocess.TimeoutExpired:
-        print(f"Timeout getting dimensions for {input_path}")
+        log.warning(f"Timed out testing encoder {encoder_name}")
         return False
 
-    dimensions = result.stdout.strip().split(',')
-    if len(dimensions) < 2:
-        print(f"Invalid dimension data for {input_path}: {result.stdout}")
-        return False
-    
-    try:
-        width = int(dimensions[0])
-        height = int(dimensions[1])
-    except ValueError:
-        print(f"Invalid dimension values for {input_path}: {dimensions}")
-        return False
+# 支持的H.264编码器及其码率参数，按优先级排列（硬件编码器优先，libx264兜底）
+VIDEO_ENCODERS = {
+    "h264_nvenc": ["-rc", "vbr", "-cq", "23", "-b:v", "8M"],    # NVIDIA
+    "h264_videotoolbox": ["-b:v", "8M"],                       # macOS
+    "h264_qsv": ["-b:v", "8M"],                                # Intel Quick Sync
+    "h264_amf": ["-b:v", "8M"],                                # AMD
+    "libx264": ["-b:v", "8M"],
+}
 
-    # 计算16:9背景尺寸
-    bg_height = int(width * 9 / 16)
-    bg_width = width
+# libx264编码预设，越靠前速度越快、压缩率越低
+X264_PRESETS = [
+    "ultrafast", "superfast", "veryfast", "faster", "fast",
+    "medium", "slow", "slower", "veryslow",
+]
 
-    # 计算信息区域高度（16:9高度的12%）
-    info_height = int(bg_height * 0.2)
+def select_video_encoder(preferred=None, frame_size=(320, 240)):
+    """选择视频编码器，返回(编码器名称, 码率参数)
 
-    # 总高度
-    total_height = bg_height + info_height
+    preferred为None时按VIDEO_ENCODERS的顺序自动选择第一个可用的编码器；
+    frame_size为输出画面尺寸，硬件编码器不支持该尺寸时不会被选中
+    """
+    candidates = [preferred] if preferred else list(VIDEO_ENCODERS)
+    for encoder_name in candidates:
+        if encoder_name == "libx264":
+            usable = is_encoder_available(encoder_name)
+        else:
+            usable = is_hardware_encoder_usable(encoder_name, *frame_size)
+        if usable:
+            return encoder_name, VIDEO_ENCODERS[encoder_name]
+    if preferred:
+        log.warning(f"Encoder {preferred} is not available, selecting automatically")
+        return select_video_encoder(frame_size=frame_size)
+    # 都不可用时交给FFmpeg选择默认的H.264编码器
+    return "h264", ["-b:v", "8M"]
 
+def preview_image_pil(input_path, text="", max_width=1280):
+    """使用Pillow快速生成预览图（与视频中的画面效果一致，但在缩小后的图片上合成）"""
     # 自动生成信息文本
     if not text:
-        exif_data = get_exif_data(input_path)
-        if exif_data['iso'] != 'N/A' and exif_data['shutter'] != 'N/A' and exif_data['fnumber'] != 'N/A':
-            text = f"{exif_data['make']} f/{exif_data['fnumber']} {exif_data['shutter']}s ISO{exif_data['iso']}"
-        else:
-            text = f"Processed {datetime.now().strftime('%Y-%m-%d')}"
+        text = get_info_text(input_path)
 
-    # 计算文字大小（基于总高度的2.5%）
-    font_size = max(40, int(total_height * 0.025))
+    with Image.open(input_path) as img:
+        original_width = img.width
+        # 输出宽度与原图宽度一致，因此只限制宽度
+        max_size = (max_width, max(1, img.height * max_width // img.width))
+        img.draft("RGB", max_size)  # JPEG可直接按DCT比例缩小解码
+        img = img.convert("RGB")
+    img.thumbnail(max_size, Image.LANCZOS)
 
-    # 阴影参数
-    shadow_size = 10
-    shadow_opacity = 0.05
-
-    # 构建FFmpeg命令
-    ffmpeg_cmd = [
-        os.path.join(thirdparty_dir, 'ffmpeg'), "-i", input_path, "-filter_complex",
-        f"[0:v]scale=w={bg_width}:h={bg_height}:force_original_aspect_ratio=decrease[fg];"
-        f"[0:v]scale=w={bg_width}:h={total_height}:force_original_aspect_ratio=increase,"
-        f"crop=w={bg_width}:h={total_height},boxblur=30:10[bg];"
-        f"[fg]pad=w=iw+{shadow_size}*2:h=ih+{shadow_size}*2:x={shadow_size}:y={shadow_size}:"
-        f"color=black@{shadow_opacity},split[fg_padded][fg_shadow];"
-        f"[fg_shadow]boxblur=10:10[shadow];"
-        f"[bg][shadow]overlay=x=(W-w)/2:y=({total_height}-h)/2-30[combined];"
-        f"[combined][fg_padded]overlay=x=(W-w)/2:y=({total_height}-h)/2-30[base];"
-        f"[base]drawtext=text='{text}':fontcolor=white:fontsize={font_size}:"
-        f"x=(w-tw)/2:y={bg_height}+{int(info_height/2)}-{int(font_size/2)}+50",
-        "-y", output_path
-    ]
+    # 按缩放比例换算原图尺寸下的各项参数
+    scale = img.width / original_width
+    bg_width = img.width
+    bg_height = max(1, int(bg_width * 9 / 16))  # 极小的图片也至少保留1像素
+    info_height = int(bg_height * 0.2)
+    total_height = bg_height + info_height
+    font_size = max(1, int(max(40, total_height / scale * 0.025) * scale))
+    shadow_size = max(1, round(10 * scale))
+    offset_y = round(30 * scale)
 
-    # 执行命令并捕获输出
-    try:
-        completed = subprocess.run(
-            ffmpeg_cmd, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.STDOUT,
-            timeout=30  # 30秒超时
-        )
-    except subprocess.TimeoutExpired:
-        print(f"Processing image {input_path} timed out")
-        return False
+    # 模糊背景：等比放大铺满后居中裁剪
+    background = ImageOps.fit(img, (bg_width, total_height)).filter(ImageFilter.GaussianBlur(30 * scale))
+    canvas = background.convert("RGBA")
 
-    # 检查执行结果
-    if completed.returncode != 0:
-        print(f"Error processing image {input_path}:\n{completed.stdout.decode()}")
-        return False
-    
-    return True
+    # 前景：等比缩小到16:9区域内（宽高至少1像素），四周加半透明黑色阴影
+    ratio = min(bg_width / img.width, bg_height / img.height)
+    foreground = img.resize((max(1, round(img.width * ratio)), max(1, round(img.height * ratio))),
+                            Image.LANCZOS)
+    shadow = Image.new("RGBA", (foreground.width + shadow_size * 2, foreground.height + shadow_size * 2),
+                       (0, 0, 0, int(255 * 0.05)))
+    shadow = shadow.filter(ImageFilter.GaussianBlur(shadow_size))
+    x = (bg_width - shadow.width) // 2
+    y = (total_height - shadow.height) // 2 - offset_y
+    # 与FFmpeg的overlay一样，超出画布的部分裁掉（阴影可能比画布还大）
+    left, top = max(0, x), max(0, y)
+    right, bottom = min(canvas.width, x + shadow.width), min(canvas.height, y + shadow.height)
+    if right > left and bottom > top:
+        canvas.alpha_composite(shadow, dest=(left, top), source=(left - x, top - y, right - x, bottom - y))
+    canvas.paste(foreground, (x + shadow_size, y + shadow_size))  # paste会自动裁掉超出的部分
 
-def get_audio_duration(audio_path):
-    """获取音频文件时长（秒）"""
+    # 信息文本
+    draw = ImageDraw.Draw(canvas)
     try:
-        result = subprocess.run(
-            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-             '-of', 'json', audio_path],
-            capture_output=True, text=True, timeout=10
-        )
-        data = json.loads(result.stdout)
-        return float(data['format']['duration'])
-    except (subprocess.CalledProcessError, KeyError, json.JSONDecodeError):
-        return 0
-    except subprocess.TimeoutExpired:
-        print(f"Timeout getting audio duration for {audio_path}")
-        return 0
+        font = ImageFont.truetype("arial.ttf", font_size)
+    except OSError:
+        font = ImageFont.load_default(size=font_size)
+    text_width = draw.textlength(text, font=font)
+    draw.text(
+        ((bg_width - text_width) / 2, bg_height + info_height / 2 - font_size / 2 + 50 * scale),
+        text, fill="white", font=font
+    )
+    return canvas.convert("RGB")
 
-def process_audio_for_video(audio_path, video_duration, temp_dir):
-    """处理音频文件以适应视频长度（循环或截断）"""
-    # 创建临时音频文件
-    processed_audio = os.path.join(temp_dir, "processed_audio.mp3")
-    
-    # 获取音频长度
-    audio_duration = get_audio_duration(audio_path)
-    
-    if audio_duration <= 0:
-        print(f"Warning: Could not get duration for audio file {audio_path}")
-        return None
-    
-    # 计算需要循环的次数
-    loop_count = math.ceil(video_duration / audio_duration)
-    
-    # 构建FFmpeg命令 - 使用更简单的格式
-    ffmpeg_cmd = [
-        os.path.join(thirdparty_dir, 'ffmpeg'),
-        "-y",
-        "-stream_loop", str(loop_count),
-        "-i", audio_path,
-        "-t", str(video_duration),  # 截断到视频长度
-        "-vn",  # 不处理视频
-        "-acodec", "libmp3lame",  # 更兼容的MP3编码器
-        "-b:a", "192k",
-        "-f", "mp3",  # 强制输出为MP3
-        processed_audio
-    ]
-    
-    # 执行命令
+def probe_image(image_path, text=""):
+    """读取图片尺寸、格式并生成信息文本，无法识别的图片返回None
+
+    尺寸、格式和EXIF在同一次打开中读取；text非空时直接使用，不再读取EXIF
+    """
     try:
-        completed = subprocess.run(
-            ffmpeg_cmd, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.STDOUT,
-            timeout=120  # 2分钟超时
-        )
-    except subprocess.TimeoutExpired:
-        print(f"Audio processing timed out for {audio_path}")
-        return None
-    
-    if completed.returncode != 0:
-        print(f"Error processing audio:\n{completed.stdout.decode()}")
+        # Image.open只解析文件头，不会解码整张图片
+        with Image.open(image_path) as img:
+            size = img.size
+            image_format = img.format
+            if not text:
+                text = format_info_text(read_exif_data(img))
+    except OSError:
         return None
-    
-    return processed_audio
+    return size, text, image_format
 
-def is_encoder_available(encoder_name):
-    """检查编码器是否可用"""
+# Pillow识别出的JPEG类格式：带MPF预览图的相机照片识别为MPO，FFmpeg同样按mjpeg解码
+JPEG_FORMATS = frozenset({"JPEG", "MPO"})
+
+def convert_to_jpeg(image_path, output_path):
+    """将图片转换为JPEG，转换失败返回False"""
     try:
-        result = subprocess.run(
-            [os.path.join(thirdparty_dir, 'ffmpeg'), "-codecs"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        # 搜索编码器是否在输出列表中
-        return encoder_name in result.stdout
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
-    except subprocess.TimeoutExpired:
-        print("Timed out checking codecs")
+        with Image.open(image_path) as img:
+            img.convert("RGB").save(output_path, "JPEG", quality=95)
+    except OSError:
         return False
+    return True
+
+def quote_concat_value(value):
+    """转义concat列表中的字符串值"""
+    return "'" + value.replace("'", "'\\''") + "'"
+
+def create_video(image_paths, output_video, duration, music=None, progress_callback=None, max_workers=None,
+                 video_encoder=None, x264_preset="veryfast", text="", stop_event=None):
+    """从处理后的图片创建视频（所有图片在同一个FFmpeg滤镜图中处理）
 
-def create_video(image_paths, output_video, duration, music=None, progress_callback=None):
-    """从处理后的图片创建视频"""
-    # 创建临时目录存放所有处理过的图片
+    text为所有图片统一使用的叠加文本，留空则根据每张图片的EXIF信息自动生成；
+    stop_event被设置时终止合成并删除未完成的输出文件
+    """
+    # 创建临时目录存放图片列表、滤镜脚本和转换后的图片
     temp_dir = tempfile.mkdtemp(prefix='video_frames_')
-    processed_images = []
     total_images = len(image_paths)
     
-    print(f"Processing {total_images} images...")
-    for i, img_path in enumerate(image_paths):
-        # 为每张图片生成输出路径
-        output_path = os.path.join(temp_dir, f"frame_{i:04d}.png")
-        if process_image(img_path, output_path):
-            processed_images.append(output_path)
-            print(f"Processed {i+1}/{total_images}: {img_path}")
+    # 并行读取图片尺寸和EXIF信息（一次性生成所有图片的信息文本），
+    # 提前剔除无法识别的图片，避免整个FFmpeg任务失败
+    max_workers = max_workers or os.cpu_count() or 1
+    log.info(f"Processing {total_images} images with {max_workers} workers...")
+    valid_images = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        image_infos = executor.map(functools.partial(probe_image, text=text), image_paths)
+        for i, (img_path, info) in enumerate(zip(image_paths, image_infos)):
+            if info:
+                valid_images.append([img_path, *info])
+                log.info(f"Processed {i+1}/{total_images}: {img_path}")
+            else:
+                log.warning(f"Skipping {img_path} due to processing error")
             # 更新进度条（图片处理阶段占比70%）
             if progress_callback:
                 progress_callback(i + 1, total_images, "processing")
-        else:
-            print(f"Skipping {img_path} due to processing error")
+        
+        # 图片读取期间已请求停止时不再转换和合成
+        if stop_event is not None and stop_event.is_set():
+            log.info("Video creation cancelled")
+            shutil.rmtree(temp_dir)
+            return False
+        
+        # concat分离器对所有文件使用同一个解码器，格式混杂时将非JPEG图片统一转换为JPEG
+        image_formats = {
+            "JPEG" if image_format in JPEG_FORMATS else image_format for _, _, _, image_format in valid_images
+        }
+        if len(image_formats) > 1:
+            to_convert = [image for image in valid_images if image[3] not in JPEG_FORMATS]
+            log.info(f"Converting {len(to_convert)} non-JPEG images...")
+            converted_paths = [
+                os.path.join(temp_dir, f"converted_{i:04d}.jpg") for i in range(len(to_convert))
+            ]
+            futures = [
+                executor.submit(convert_to_jpeg, image[0], converted_path)
+                for image, converted_path in zip(to_convert, converted_paths)
+            ]
+            for image, converted_path, future in zip(to_convert, converted_paths, futures):
+                # 转换期间请求停止时取消尚未开始的转换，等待进行中的转换结束后再清理
+                if stop_event is not None and stop_event.is_set():
+                    executor.shutdown(cancel_futures=True)
+                    log.info("Video creation cancelled")
+                    shutil.rmtree(temp_dir)
+                    return False
+                if future.result():
+                    image[0] = converted_path
+                else:
+                    log.warning(f"Skipping {image[0]} due to processing error")
+                    valid_images.remove(image)
     
-    if not processed_images:
-        print("No valid images processed. Exiting.")
+    if not valid_images:
+        log.error("No valid images processed. Exiting.")
         shutil.rmtree(temp_dir)
         return False
     
+    image_count = len(valid_images)
+    
     # 计算视频总时长
-    total_duration = len(processed_images) * duration
+    total_duration = image_count * duration
     
-    # 处理音频（如果需要）
-    final_audio = None
-    if music:
-        print("Processing background music...")
-        final_audio = process_audio_for_video(music, total_duration, temp_dir)
-        if not final_audio:
-            print("Using video without audio due to audio processing error")
-    
-    # 检查可用的编码器 - 优先使用兼容性编码器
-    if is_encoder_available("libx264"):
-        print("Using libx264 encoder")
-        video_codec = "libx264"
-        pix_fmt = "yuv420p"
-        bitrate_options = ["-b:v", "8M"]
-    else:
-        print("Using H.264 encoder")
-        video_codec = "h264"
-        pix_fmt = "yuv420p"
-        bitrate_options = ["-b:v", "8M"]
+    # 输出画面尺寸以第一张图片为准（宽高取偶数以兼容yuv420p）
+    canvas_width = valid_images[0][1][0] // 2 * 2
+    canvas_height = int(canvas_width * 9 / 16 * 1.2) // 2 * 2
+    
+    # 选择编码器 - 优先使用支持该画面尺寸的硬件编码器
+    video_codec, bitrate_options = select_video_encoder(video_encoder, (canvas_width, canvas_height))
+    log.info(f"Using {video_codec} encoder")
+    pix_fmt = "yuv420p"
+    frame_rate = 25
+    
+    # 每张图片开始附近放置关键帧，方便拖动定位
+    encoder_options = [*bitrate_options, "-g", str(max(1, round(duration * frame_rate)))]
+    if video_codec == "libx264":
+        # 幻灯片画面几乎静止，较快的预设即可保证质量，并使用全部CPU核心
+        encoder_options.extend(["-preset", x264_preset, "-tune", "stillimage", "-threads", "0"])
+    
+    # 使用concat分离器按顺序读取图片：每张图片只解码和处理一次，持续时间由列表指定，
+    # 信息文本作为包元数据随帧传递，由drawtext通过%{metadata}读取；
+    # 列表中的相对路径以列表文件所在目录为准，因此统一写入绝对路径
+    concat_list = os.path.join(temp_dir, "images.ffconcat")
+    with open(concat_list, "w", encoding="utf-8") as f:
+        f.write("ffconcat version 1.0\n")
+        for img_path, _, text, _ in valid_images:
+            f.write(f"file {quote_concat_value(os.path.abspath(img_path))}\n")
+            f.write(f"file_packet_meta caption {quote_concat_value(text)}\n")
+            f.write(f"duration {duration}\n")
+        # 重复最后一张图片，保证最后一段也能持续完整时长
+        img_path, _, text, _ = valid_images[-1]
+        f.write(f"file {quote_concat_value(os.path.abspath(img_path))}\n")
+        f.write(f"file_packet_meta caption {quote_concat_value(text)}\n")
+    
+    # 构建滤镜图：单条处理链，再缩放填充到统一画面尺寸；
+    # 在滤镜图内用fps转换帧率，每张图片按列表中的持续时间重复成完整的帧序列
+    # （输出端的-r只会把帧重复到下一帧的时间戳，最后一张图片会只剩一帧）
+    filter_graph = (
+        build_image_filter("0:v", "img", "%{metadata\\:caption}") + ";"
+        f"[img]scale=w={canvas_width}:h={canvas_height}:force_original_aspect_ratio=decrease,"
+        f"pad=w={canvas_width}:h={canvas_height}:x=(ow-iw)/2:y=(oh-ih)/2,setsar=1,fps={frame_rate}[outv]"
+    )
+    
+    # 滤镜图写入脚本文件，避免命令行转义问题
+    filter_script = os.path.join(temp_dir, "filters.txt")
+    with open(filter_script, "w", encoding="utf-8") as f:
+        f.write(filter_graph)
     
     # 构建FFmpeg视频创建命令
+    # FFmpeg内部的读取、解码、滤镜和编码各自运行在独立线程中，形成流水线；
+    # 滤镜线程数与并行任务数一致，使模糊等耗时滤镜能跟上编码速度
     ffmpeg_cmd = [
         os.path.join(thirdparty_dir, 'ffmpeg'), "-y",
-        "-framerate", str(1/float(duration)), 
-        "-i", os.path.join(temp_dir, "frame_%04d.png"),
+        "-hide_banner", "-loglevel", "warning",  # 只输出警告和错误，减少经管道传输的日志
+        "-progress", "pipe:1", "-nostats",  # 输出机器可读的进度信息
+        "-filter_complex_threads", str(max_workers),
+        "-f", "concat", "-safe", "0", "-i", concat_list,
     ]
     
-    # 添加音频输入（如果有）
-    if final_audio:
-        ffmpeg_cmd.extend(["-i", final_audio])
+    # 音乐文件不可用时不影响视频本身，去掉音乐继续创建
+    if music and not (os.path.isfile(music) and os.access(music, os.R_OK)):
+        log.warning(f"Cannot read music file {music}, using video without audio")
+        music = None
+    
+    # 添加音频输入（如果有），由FFmpeg无限循环音频并在视频结束时截断，无需预先重新编码
+    if music:
+        log.info("Adding background music...")
+        ffmpeg_cmd.extend(["-stream_loop", "-1", "-i", music])
     
     # 设置输出选项
     ffmpeg_cmd.extend([
+        "-filter_complex_script", filter_script,
+        "-map", "[outv]",
         "-c:v", video_codec,
-        *bitrate_options,
-        "-r", "25",   # 输出帧率25fps
+        *encoder_options,
+        "-r", str(frame_rate),   # 输出帧率25fps
         "-pix_fmt", pix_fmt,
         "-movflags", "+faststart",
+        "-t", str(total_duration),  # 截断到视频长度（循环的音频也随之截断）
     ])
     
     # 设置音频选项（如果有音频）
-    if final_audio:
+    if music:
         ffmpeg_cmd.extend([
             "-c:a", "aac",  # 使用AAC音频编码器
             "-b:a", "192k",
-            "-map", "0:v:0", "-map", "1:a:0"  # 明确映射视频和音频流
+            "-map", "1:a:0?",  # 文件中没有音频流时忽略，不中断合成
         ])
     else:
         ffmpeg_cmd.append("-an")  # 没有音频
@@ -284,50 +448,81 @@ def create_video(image_paths, output_video, duration, music=None, progress_callb
     ffmpeg_cmd.append(output_video)
     
     # 执行视频创建命令
-    print("Creating video...")
-    print("Executing command:", " ".join(ffmpeg_cmd))
+    log.info("Creating video...")
+    log.info("Executing command: %s", " ".join(ffmpeg_cmd))
     
     # 通知UI开始视频合成阶段
     if progress_callback:
         progress_callback(0, 0, "compiling")
     
+    # 选择编码器时的测试编码可能耗时较长，启动FFmpeg前再检查一次停止请求
+    if stop_event is not None and stop_event.is_set():
+        log.info("Video creation cancelled")
+        shutil.rmtree(temp_dir)
+        return False
+    
+    output_tail = collections.deque(maxlen=20)
     try:
         # 启动视频合成进程
         with subprocess.Popen(
             ffmpeg_cmd, 
             stdout=subprocess.PIPE, 
-            stderr=subprocess.STDOUT,
-            text=True
+            stderr=subprocess.STDOUT
         ) as proc:
-            # 读取输出以捕获错误（但不需要显示进度）
+            # 解析-progress输出的key=value进度信息，其余日志保留最后几行用于错误诊断
+            # （以字节读取，只在出错时才解码日志）
             for line in proc.stdout:
-                if progress_callback:
-                    # 简单模拟视频合成进度（从70%到100%）
-                    progress = 70 + 30 * (proc.poll() is None) / 2
+                if stop_event is not None and stop_event.is_set():
+                    proc.kill()  # 输出文件反正要删除，无需等待FFmpeg正常收尾
+                    break
+                key, sep, value = line.strip().partition(b"=")
+                if not sep or b" " in key:
+                    output_tail.append(line)
+                elif key == b"out_time_us" and progress_callback and value.isdigit():
+                    progress = min(100.0, int(value) / (total_duration * 1e6) * 100)
                     progress_callback(progress, 100, "compiling")
-                # 可以在这里解析FFmpeg进度信息（如果更精确的进度跟踪是必需的）
-                pass
                 
             # 等待进程完成
             proc.wait()
             returncode = proc.returncode
     except Exception as e:
-        print(f"Video creation error: {str(e)}")
+        log.error(f"Video creation error: {str(e)}")
         returncode = -1
     
     # 清理临时文件
     shutil.rmtree(temp_dir)
     
+    if stop_event is not None and stop_event.is_set():
+        log.info("Video creation cancelled")
+        try:
+            os.remove(output_video)
+        except OSError:
+            pass
+        return False
+    
     if returncode != 0:
-        print(f"Error creating video (return code {returncode})")
+        error_output = b"".join(output_tail).decode(errors="replace")
+        log.error(f"Error creating video (return code {returncode})")
+        log.error("%s", error_output)
+        if "file_packet_meta" in error_output:
+            log.error(f"The FFmpeg in {thirdparty_dir} is too old, FFmpeg {MIN_FFMPEG_VERSION} or newer is required")
         return False
     
-    print(f"Successfully created video: {output_video}")
-    print(f"Video duration: {total_duration} seconds")
-    print(f"Number of images: {len(processed_images)}")
-    progress_callback(progress, 100, "compiling")
+    log.info(f"Successfully created video: {output_video}")
+    log.info(f"Video duration: {total_duration} seconds")
+    log.info(f"Number of images: {image_count}")
+    if progress_callback:
+        progress_callback(100, 100, "compiling")
     return True
 
+# 预览缓存的最大条目数（每条约为1280像素宽的RGB图片）
+PREVIEW_CACHE_SIZE = 32
+
+class UILogHandler(logging.handlers.QueueHandler):
+    """把日志记录以("log", 文本)消息的形式放入界面更新队列"""
+    def prepare(self, record):
+        return ("log", self.format(record))
+
 class VideoCreatorApp:
     def __init__(self, root):
         self.root = root
@@ -338,7 +533,7 @@ class VideoCreatorApp:
         # 设置应用图标
         try:
             root.iconbitmap("PicVideo_Pro.ico")  # Windows系统
-        except:
+        except tk.TclError:
             pass  # Linux/macOS可能不支持
         
         # 样式配置（使用系统默认外观）
@@ -388,6 +583,7 @@ class VideoCreatorApp:
         )
         self.img_listbox.pack(fill=tk.BOTH, expand=True)
         scrollbar.config(command=self.img_listbox.yview)
+        self.img_path_set = set()  # 与列表内容同步，用于快速判断图片是否已添加
         
         # 绑定选择事件
         self.img_listbox.bind('<<ListboxSelect>>', self.on_image_select)
@@ -420,6 +616,39 @@ class VideoCreatorApp:
         duration_entry = ttk.Entry(output_row2, textvariable=self.duration_var, width=8)
         duration_entry.pack(side=tk.LEFT, padx=5)
         
+        output_row3 = ttk.Frame(output_frame)
+        output_row3.pack(fill=tk.X, pady=3)
+        ttk.Label(output_row3, text="并行处理任务数:").pack(side=tk.LEFT)
+        self.workers_var = tk.IntVar(value=os.cpu_count() or 1)
+        workers_entry = ttk.Entry(output_row3, textvariable=self.workers_var, width=8)
+        workers_entry.pack(side=tk.LEFT, padx=5)
+        
+        output_row4 = ttk.Frame(output_frame)
+        output_row4.pack(fill=tk.X, pady=3)
+        ttk.Label(output_row4, text="视频编码器:").pack(side=tk.LEFT)
+        self.encoder_var = tk.StringVar(value="自动")
+        encoder_combo = ttk.Combobox(
+            output_row4,
+            textvariable=self.encoder_var,
+            values=["自动", *VIDEO_ENCODERS],
+            state="readonly",
+            width=18
+        )
+        encoder_combo.pack(side=tk.LEFT, padx=5)
+        
+        output_row5 = ttk.Frame(output_frame)
+        output_row5.pack(fill=tk.X, pady=3)
+        ttk.Label(output_row5, text="x264编码预设:").pack(side=tk.LEFT)
+        self.preset_var = tk.StringVar(value="veryfast")
+        preset_combo = ttk.Combobox(
+            output_row5,
+            textvariable=self.preset_var,
+            values=X264_PRESETS,
+            state="readonly",
+            width=18
+        )
+        preset_combo.pack(side=tk.LEFT, padx=5)
+        
         # 音乐设置
         music_frame = ttk.LabelFrame(settings_frame, text="音频设置")
         music_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -450,7 +679,7 @@ class VideoCreatorApp:
         self.create_btn = ttk.Button(control_frame, text="创建视频", command=self.start_creation)
         self.create_btn.pack(side=tk.LEFT, padx=5)
         
-        ttk.Button(control_frame, text="退出", command=root.quit).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(control_frame, text="退出", command=self.on_closing).pack(side=tk.RIGHT, padx=5)
         
         # 下部框架：进度条和日志
         bottom_frame = ttk.Frame(main_frame)
@@ -471,6 +700,7 @@ class VideoCreatorApp:
         
         # 进度标签
         self.progress_label = ttk.Label(progress_frame, text="准备就绪")
+        self.progress_text = "准备就绪"
         self.progress_label.pack(fill=tk.X, padx=5, pady=2)
         
         # 日志区域
@@ -483,43 +713,89 @@ class VideoCreatorApp:
         scrollbar_log.pack(side=tk.RIGHT, fill=tk.Y)
         self.log_text.config(yscrollcommand=scrollbar_log.set)
         
-        # 重定向标准输出
-        self.original_stdout = sys.stdout
-        sys.stdout = self
+        # 后台线程的界面更新消息（进度和日志），由UI线程定期统一处理，
+        # 后台线程不直接操作Tk控件
+        self.ui_queue = queue.Queue()
+        self.log_handler = UILogHandler(self.ui_queue)
+        self.log_handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(self.log_handler)
+        log.setLevel(logging.INFO)
         
         # 线程控制
         self.creation_thread = None
-        self.preview_thread = None
-        self.stop_flag = False
+        self.stop_flag = threading.Event()  # 设置后终止正在进行的视频合成
+        self.done_event = threading.Event()  # 后台任务结束时设置
+        self.done_event.set()
+        self.exit_dialog = None  # 任务进行中关闭窗口时的确认窗口
         
         # 预览组件
-        self.temp_preview_path = None
-        self.current_preview = None
+        self.current_preview = None  # 最近一次请求预览的图片路径
+        
+        # 预览缓存：(路径, 修改时间, 文件大小) -> 合成后的预览图，仅由预览线程访问
+        self.preview_cache = collections.OrderedDict()
+        
+        # 预览工作线程：队列最多保留一个请求，快速切换选择时只处理最新的图片
+        self.preview_queue = queue.Queue(maxsize=1)
+        self.preview_thread = threading.Thread(target=self.preview_loop, daemon=True)
+        self.preview_thread.start()
         
         # 初始状态
         self.progress_var.set(0)
         self.update_progress_label(0, 0)
+        self.drain_ui_queue()
         
-    def write(self, message):
-        """重定向print到日志文本框"""
-        self.log_text.insert(tk.END, message)
-        self.log_text.see(tk.END)
-        
-    def flush(self):
-        """标准输出需要的方法"""
-        pass
+    def drain_ui_queue(self):
+        """处理后台线程发来的所有界面更新消息（约30次/秒），日志一次性写入文本框"""
+        progress = None
+        lines = []
+        done = None
+        try:
+            while True:
+                kind, value = self.ui_queue.get_nowait()
+                if kind == "progress":
+                    progress = value  # 只保留最新进度
+                elif kind == "log":
+                    lines.append(value + "\n")
+                elif kind == "done":
+                    done = value
+        except queue.Empty:
+            pass
+        # 每次处理最多更新一次进度条和标签
+        if progress is not None:
+            self.progress_var.set(progress)
+            self.update_progress_label(progress, 100)
+        if lines:
+            self.log_text.insert(tk.END, "".join(lines))
+            self.log_text.see(tk.END)
+        self.drain_job = self.root.after(33, self.drain_ui_queue)
+        # 任务结束消息在同批的进度和日志之后处理，避免最终状态被旧进度覆盖；
+        # 下一次处理已先排定，结果提示框打开期间界面仍会刷新
+        if done is not None:
+            self.finalize_ui(*done)
     
     def update_progress_label(self, current, total, phase=None):
         """更新进度标签显示"""
         if phase == "processing":
-            self.progress_label.config(text=f"图片处理中: {current}/{total} ({current/total*100:.1f}%)")
+            self.set_progress_text(f"图片处理中: {current}/{total} ({current/total*100:.1f}%)")
         elif phase == "compiling":
             if total == 0:
-                self.progress_label.config(text="视频合成中...")
+                self.set_progress_text("视频合成中...")
             else:
-                self.progress_label.config(text=f"视频合成中: {current:.1f}%")
+                self.set_progress_text(f"视频合成中: {current:.1f}%")
         else:
-            self.progress_label.config(text="准备就绪" if current == 0 else f"完成进度: {current:.1f}%")
+            self.set_progress_text("准备就绪" if current == 0 else f"完成进度: {current:.1f}%")
+    
+    def set_progress_text(self, text):
+        """设置进度标签文本，文本未变化时跳过以免重复重绘"""
+        if text != self.progress_text:
+            self.progress_text = text
+            self.progress_label.config(text=text)
+    
+    def add_image(self, path):
+        """添加单张图片到列表（已存在则忽略）"""
+        if path not in self.img_path_set:
+            self.img_path_set.add(path)
+            self.img_listbox.insert(tk.END, path)
     
     def add_files(self):
         """添加图片文件"""
@@ -527,29 +803,26 @@ class VideoCreatorApp:
             filetypes=[("图片文件", "*.jpg *.jpeg *.png *.bmp *.tiff *.jpe")]
         )
         for file in files:
-            if file not in self.img_listbox.get(0, tk.END):
-                self.img_listbox.insert(tk.END, file)
+            self.add_image(file)
     
     def add_directory(self):
         """添加目录中的所有图片"""
         directory = filedialog.askdirectory()
         if directory:
-            for root, _, files in os.walk(directory):
-                for file in files:
-                    if file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.jpe')):
-                        path = os.path.join(root, file)
-                        if path not in self.img_listbox.get(0, tk.END):
-                            self.img_listbox.insert(tk.END, path)
+            for path in iter_image_files(directory):
+                self.add_image(path)
     
     def remove_selected(self):
         """移除选中的项目"""
         selected = self.img_listbox.curselection()
         for i in selected[::-1]:  # 反向删除避免索引变化
+            self.img_path_set.discard(self.img_listbox.get(i))
             self.img_listbox.delete(i)
     
     def clear_list(self):
         """清空图片列表"""
         self.img_listbox.delete(0, tk.END)
+        self.img_path_set.clear()
         self.clear_preview()
     
     def browse_output(self):
@@ -592,43 +865,50 @@ class VideoCreatorApp:
             font=("Arial", 12)
         )
         
-        # 在后台线程中加载预览
-        self.preview_thread = threading.Thread(
-            target=self.load_preview,
-            args=(img_path,),
-            daemon=True
-        )
-        self.preview_thread.start()
+        # 交给预览线程加载，替换掉尚未开始处理的旧请求
+        self.current_preview = img_path
+        try:
+            self.preview_queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.preview_queue.put_nowait(img_path)
+        
+    def preview_loop(self):
+        """预览工作线程：依次处理队列中的预览请求"""
+        while True:
+            img_path = self.preview_queue.get()
+            self.load_preview(img_path)
         
     def load_preview(self, img_path):
         """在后台线程中加载预览图片"""
         try:
-            # 清理上一次的临时预览文件
-            if self.temp_preview_path and os.path.exists(self.temp_preview_path):
-                try:
-                    os.remove(self.temp_preview_path)
-                except:
-                    pass
-            
-            # 创建临时预览文件
-            temp_dir = tempfile.gettempdir()
-            self.temp_preview_path = os.path.join(temp_dir, f"preview_{os.path.basename(img_path)}")
-            
-            # 处理图片（使用空文本生成预览）
-            if process_image(img_path, self.temp_preview_path, text=""):
-                # 在UI线程中显示处理后的图片
-                self.root.after(0, self.display_preview, img_path)
+            # 文件被修改后修改时间或大小会变化，缓存自然失效
+            stat = os.stat(img_path)
+            cache_key = (img_path, stat.st_mtime_ns, stat.st_size)
+            preview = self.preview_cache.get(cache_key)
+            if preview is not None:
+                self.preview_cache.move_to_end(cache_key)
             else:
-                # 处理失败则显示原图
-                self.root.after(0, self.display_original, img_path)
+                # 使用Pillow在内存中合成预览（使用空文本生成预览）
+                preview = preview_image_pil(img_path, text="")
+                self.preview_cache[cache_key] = preview
+                if len(self.preview_cache) > PREVIEW_CACHE_SIZE:
+                    self.preview_cache.popitem(last=False)  # 淘汰最久未使用的预览
         except Exception as e:
-            print(f"预览加载错误: {str(e)}")
+            log.error(f"预览生成错误: {str(e)}")
+            # 处理失败则显示原图
+            self.root.after(0, self.display_original, img_path)
+            return
+        # 处理期间已有新的预览请求时丢弃结果
+        if not self.preview_queue.empty():
+            return
+        # 在UI线程中显示处理后的图片
+        self.root.after(0, self.display_preview, img_path, preview)
             
-    def display_preview(self, img_path):
+    def display_preview(self, img_path, img):
         """在预览区显示处理后的图片"""
-        if not os.path.exists(self.temp_preview_path):
-            self.display_original(img_path)
-            return
+        if img_path != self.current_preview:
+            return  # 已选择了其他图片
             
         try:
             # 获取画布尺寸
@@ -640,9 +920,6 @@ class VideoCreatorApp:
                 canvas_width = 500
                 canvas_height = 280  # 16:9的比例 (500 * 9/16)
             
-            # 加载处理后的图片
-            img = Image.open(self.temp_preview_path)
-            
             # 调整大小适应预览区域
             aspect_ratio = img.width / img.height
             target_width = canvas_width - 20  # 左右留出10px边距
@@ -653,7 +930,8 @@ class VideoCreatorApp:
                 target_height = canvas_height - 20
                 target_width = int(target_height * aspect_ratio)
                 
-            img = img.resize((target_width, target_height), Image.LANCZOS)
+            # 缓存中的图片不能原地修改，先按整数倍快速缩小再做LANCZOS
+            img = img.resize((target_width, target_height), Image.LANCZOS, reducing_gap=2.0)
             photo = ImageTk.PhotoImage(img)
             
             # 清除画布并显示图片
@@ -687,11 +965,14 @@ class VideoCreatorApp:
             )
             
         except Exception as e:
-            print(f"预览显示错误: {str(e)}")
+            log.error(f"预览显示错误: {str(e)}")
             self.clear_preview()
             
     def display_original(self, img_path):
         """在预览区显示原图"""
+        if img_path != self.current_preview:
+            return  # 已选择了其他图片
+            
         try:
             # 获取画布尺寸
             canvas_width = self.preview_canvas.winfo_width()
@@ -703,19 +984,21 @@ class VideoCreatorApp:
                 canvas_height = 280  # 16:9的比例 (500 * 9/16)
             
             # 加载原始图片
-            img = Image.open(img_path)
-            
-            # 调整大小适应预览区域
-            aspect_ratio = img.width / img.height
-            target_width = canvas_width - 20  # 左右留出10px边距
-            target_height = int(target_width / aspect_ratio)
-            
-            # 如果高度超出，则根据高度调整
-            if target_height > canvas_height - 20:  # 上下留出10px边距
-                target_height = canvas_height - 20
-                target_width = int(target_height * aspect_ratio)
+            with Image.open(img_path) as img:
+                # 调整大小适应预览区域
+                aspect_ratio = img.width / img.height
+                target_width = canvas_width - 20  # 左右留出10px边距
+                target_height = int(target_width / aspect_ratio)
                 
-            img = img.resize((target_width, target_height), Image.LANCZOS)
+                # 如果高度超出，则根据高度调整
+                if target_height > canvas_height - 20:  # 上下留出10px边距
+                    target_height = canvas_height - 20
+                    target_width = int(target_height * aspect_ratio)
+                
+                # JPEG按DCT比例缩小解码，LANCZOS只需处理较小的图片
+                img.draft("RGB", (target_width * 2, target_height * 2))
+                img.thumbnail((target_width, target_height), Image.LANCZOS)
+            target_width, target_height = img.size
             photo = ImageTk.PhotoImage(img)
             
             # 清除画布并显示图片
@@ -756,7 +1039,7 @@ class VideoCreatorApp:
                 font=("Arial", 10)
             )
         except Exception as e:
-            print(f"原图预览错误: {str(e)}")
+            log.error(f"原图预览错误: {str(e)}")
             self.clear_preview()
             
     def clear_preview(self):
@@ -770,6 +1053,7 @@ class VideoCreatorApp:
             font=("Arial", 14)
         )
         self.preview_image = None
+        self.current_preview = None
     
     def start_creation(self):
         """开始创建视频"""
@@ -797,6 +1081,19 @@ class VideoCreatorApp:
             messagebox.showerror("错误", "持续时间必须是一个正数")
             return
         
+        try:
+            max_workers = int(self.workers_var.get())
+            if max_workers <= 0:
+                raise ValueError
+        except (ValueError, tk.TclError):
+            messagebox.showerror("错误", "并行处理任务数必须是一个正整数")
+            return
+        
+        video_encoder = self.encoder_var.get()
+        if video_encoder == "自动":
+            video_encoder = None
+        x264_preset = self.preset_var.get()
+        
         # 准备参数
         MAX_IMAGES = 100
         if len(img_paths) > MAX_IMAGES:
@@ -806,8 +1103,9 @@ class VideoCreatorApp:
         # 清空日志和进度
         self.log_text.delete(1.0, tk.END)
         self.progress_var.set(0)
-        self.progress_label.config(text="开始处理图片...")
-        self.stop_flag = False
+        self.set_progress_text("开始处理图片...")
+        self.stop_flag.clear()
+        self.done_event.clear()
         
         # 禁用按钮
         self.create_btn.config(state=tk.DISABLED)
@@ -815,16 +1113,16 @@ class VideoCreatorApp:
         # 在后台线程中创建视频
         self.creation_thread = threading.Thread(
             target=self.run_creation,
-            args=(img_paths, output_path, duration, music, text),
+            args=(img_paths, output_path, duration, music, text, max_workers, video_encoder, x264_preset),
             daemon=True
         )
         self.creation_thread.start()
-        
-        # 定期检查线程状态
-        self.check_thread_status()
     
-    def run_creation(self, img_paths, output_path, duration, music, text):
-        """在后台线程中运行创建过程"""
+    def run_creation(self, img_paths, output_path, duration, music, text, max_workers, video_encoder,
+                     x264_preset):
+        """在后台线程中运行创建过程，结束后交由UI线程更新界面"""
+        success = False
+        error = None
         try:
             # 进度更新回调函数
             def progress_callback(current, total, phase=None):
@@ -832,73 +1130,99 @@ class VideoCreatorApp:
                 if phase == "processing":
                     # 图片处理阶段占总进度的70%
                     progress = min(70.0, current / total * 70.0)
-                    self.progress_var.set(progress)
-                    self.update_progress_label(progress, 100)
+                    self.ui_queue.put(("progress", progress))
                 elif phase == "compiling":
                     # 视频合成阶段占总进度的30%，从70%开始
                     progress = min(100.0, 70.0 + (current / 100.0) * 30.0)
-                    self.progress_var.set(progress)
-                    self.update_progress_label(progress, 100)
+                    self.ui_queue.put(("progress", progress))
             
             # 保存图片列表到临时文件
             with open("temp_img_list.txt", "w") as f:
                 f.write("\n".join(img_paths))
             
             # 创建视频（传递进度回调）
-            success = create_video(img_paths, output_path, duration, music, progress_callback)
+            success = create_video(
+                img_paths, output_path, duration, music, progress_callback,
+                max_workers, video_encoder, x264_preset, text, self.stop_flag
+            )
             
-            # 完成后更新状态
             if success:
-                print("\n视频创建完成!")
-                self.progress_var.set(100)
-                self.update_progress_label(100, 100)
-                messagebox.showinfo("成功", f"视频已成功创建: {os.path.abspath(output_path)}")
-            else:
-                messagebox.showerror("错误", "视频创建失败，请查看日志")
+                log.info("视频创建完成!")
             
         except Exception as e:
-            print(f"\n发生错误: {str(e)}")
-            messagebox.showerror("错误", f"创建视频时出错: {str(e)}")
+            log.error(f"发生错误: {str(e)}")
+            error = e
         
         finally:
             # 尝试删除临时文件
             try:
                 os.remove("temp_img_list.txt")
-            except:
+            except OSError:
                 pass
             
-            # 恢复UI状态
-            self.create_btn.config(state=tk.NORMAL)
-            self.update_progress_label(100, 100)
-    
-    def check_thread_status(self):
-        """定期检查线程状态和更新进度"""
-        if self.creation_thread and self.creation_thread.is_alive():
-            # 每1秒检查一次
-            self.root.after(1000, self.check_thread_status)
+            # 经队列通知UI线程任务已结束，后台线程不直接调用Tk
+            self.done_event.set()
+            self.ui_queue.put(("done", (output_path, success, error)))
+    
+    def finalize_ui(self, output_path, success, error):
+        """在UI线程中恢复界面状态并提示创建结果"""
+        self.create_btn.config(state=tk.NORMAL)
+        if success:
+            self.progress_var.set(100)
+        self.update_progress_label(100, 100)
+        
+        if error is not None:
+            messagebox.showerror("错误", f"创建视频时出错: {str(error)}")
+        elif success:
+            messagebox.showinfo("成功", f"视频已成功创建: {os.path.abspath(output_path)}")
         else:
-            # 线程完成
-            pass
+            messagebox.showerror("错误", "视频创建失败，请查看日志")
     
     def on_closing(self):
         """窗口关闭时的清理操作"""
-        if self.creation_thread and self.creation_thread.is_alive():
-            if messagebox.askokcancel("退出", "视频创建仍在进行中，确定要退出吗?"):
-                # 设置停止标志（需要更多实现才能实际停止进程）
-                self.stop_flag = True
-                self.root.destroy()
-        else:
-            self.root.destroy()
-        
-        # 清理临时预览文件
-        if self.temp_preview_path and os.path.exists(self.temp_preview_path):
-            try:
-                os.remove(self.temp_preview_path)
-            except:
-                pass
+        if self.done_event.is_set():
+            self.close_app()
+            return
         
-        # 恢复标准输出
-        sys.stdout = self.original_stdout
+        # 视频仍在创建时弹出非阻塞的确认窗口，主循环继续处理进度和日志
+        if self.exit_dialog is not None:
+            self.exit_dialog.lift()
+            return
+        dialog = tk.Toplevel(self.root)
+        dialog.title("退出")
+        dialog.resizable(False, False)
+        dialog.transient(self.root)
+        ttk.Label(dialog, text="视频创建仍在进行中，确定要退出吗?").pack(padx=20, pady=(15, 10))
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=(0, 15))
+        ttk.Button(btn_frame, text="确定", command=self.close_app).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="取消", command=self.close_exit_dialog).pack(side=tk.LEFT, padx=5)
+        dialog.protocol("WM_DELETE_WINDOW", self.close_exit_dialog)
+        dialog.grab_set()
+        self.exit_dialog = dialog
+    
+    def close_exit_dialog(self):
+        """关闭退出确认窗口"""
+        self.exit_dialog.destroy()
+        self.exit_dialog = None
+    
+    def close_app(self):
+        """停止后台任务，释放资源并退出主循环"""
+        try:
+            if not self.done_event.is_set():
+                # 终止FFmpeg并等待后台线程删除未完成的视频文件
+                self.stop_flag.set()
+                self.creation_thread.join(timeout=2.0)
+        finally:
+            # 即使停止任务时出错也要释放资源并退出主循环，窗口由main()销毁
+            self.cleanup_resources()
+            self.root.quit()
+    
+    def cleanup_resources(self):
+        """释放应用占用的资源"""
+        log.removeHandler(self.log_handler)
+        # 取消已排定的界面更新，窗口销毁后不再重新调度
+        self.root.after_cancel(self.drain_job)
 
 def main():
     """应用程序入口"""
@@ -906,6 +1230,12 @@ def main():
     app = VideoCreatorApp(root)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
     root.mainloop()
+    
+    # 退出主循环后再销毁窗口，避免在Tcl回调中销毁引发错误
+    try:
+        root.destroy()
+    except tk.TclError:
+        pass
 
 if __name__ == "__main__":
     main()
\ No newline at end of file